@@ -5,28 +5,479 @@ from the warp-bubble expressions in final_expressions.tex.
 """
 
 import sympy as sp
+from sympy.core.function import AppliedUndef
 from sympy.parsing.latex import parse_latex
+from sympy.printing.numpy import NumPyPrinter
 import argparse
+import functools
+import hashlib
+import keyword
+import mmap
+import multiprocessing
 import re
 import os
+import pathlib
+import pickle
+
+try:
+    import symengine as se
+except ImportError:
+    se = None
+
+SIMPLIFY_MODES = ('none', 'cancel', 'full')
+NUMERIC_BACKENDS = ('numba', 'symengine-llvm')
+
+# Bound on the in-process parse memo below; it holds full SymPy trees, so
+# an unbounded cache would keep every parsed input alive for the whole run.
+_MEMO_SIZE = 32
+
+# Bump whenever stencil derivation or rendering changes so that --cache-dir
+# entries written by older code are not reused.
+_CACHE_FORMAT = 5
+
+_PREAMBLE = ("\\documentclass{article}\n"
+             "\\usepackage{amsmath}\n"
+             "\\usepackage[margin=0.5in]{geometry}\n"
+             "\\begin{document}\n\n")
+_POSTAMBLE = "\\end{document}\n"
+
+_NUMERIC_TEMPLATE = '''"""{doc}
+"""
+import numpy
+
+try:
+    from numba import njit
+except ImportError:
+    def njit(*args, **kwargs):
+        return lambda fn: fn
+
+
+@njit(cache=True, fastmath=True)
+def evaluate({args}):
+{body}
+'''
+
+_LLVM_STUB_TEMPLATE = '''"""{doc}
+"""
+import pathlib
+import pickle
+
+import numpy
+
+with open(pathlib.Path(__file__).with_suffix(".pkl"), "rb") as _f:
+    _compiled = pickle.load(_f)
+
+
+def evaluate({args}):
+    return _compiled(numpy.stack(numpy.broadcast_arrays({args}), axis=-1))
+'''
+
+_DISPLAY_MATH_RE = re.compile(rb'\\\[(.*?)\\\]', re.DOTALL)
 
 def extract_expressions(tex):
-    """Extract all display-math LaTeX expressions between \\[ and \\]."""
-    return re.findall(r'\\\[(.*?)\\\]', tex, re.DOTALL)
+    """Iterate over display-math matches between \\[ and \\] in the bytes-like
+    tex; group(1) is the undecoded body."""
+    return _DISPLAY_MATH_RE.finditer(tex)
+
+def iter_input_expressions(path):
+    """Yield the decoded display-math bodies of the TeX file at path.
+
+    The file is memory-mapped and scanned as bytes; only the matched
+    bodies are decoded, never the whole file.
+    """
+    with open(path, 'rb') as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return  # mmap cannot map an empty file
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            for m in extract_expressions(mm):
+                yield m.group(1).decode('utf-8')
+
+@functools.lru_cache(maxsize=_MEMO_SIZE)
+def _parse_latex_cached(s):
+    """Parse a normalized LaTeX string, reusing results for repeated inputs."""
+    return parse_latex(s)
+
+def _normalize_whitespace(s):
+    """Collapse whitespace runs to one space; dropping them entirely would
+    merge distinct inputs such as \\sin x and \\sinx."""
+    return re.sub(r"\s+", " ", s.strip())
 
-def generate_central_diff(expr, var, order=2):
-    """Generate a central finite-difference stencil for derivative wrt var."""
+def parse_latex_cached(s):
+    """Normalize whitespace in s and parse it through the memoized parser."""
+    return _parse_latex_cached(_normalize_whitespace(s))
+
+def central_shifts(expr, var, h):
+    """Precompute expr evaluated at var+k*h for the central stencil offsets.
+
+    When SymEngine is installed the substitutions run there and the values
+    are SymEngine objects; generate_central_diff() converts the combined
+    numerator back to SymPy once. Expressions containing Derivative or Subs
+    nodes always use SymPy: SymEngine rewrites Derivative(f(r), r) under
+    r -> r + h as a derivative with respect to r + h, which SymPy cannot
+    represent when converting back.
+    """
+    offsets = (1, -1, 2, -2)
+    if se is not None and not expr.has(sp.Derivative, sp.Subs):
+        try:
+            se_expr, se_var, se_h = se.sympify(expr), se.sympify(var), se.sympify(h)
+            return {k: se_expr.subs({se_var: se_var + k*se_h}) for k in offsets}
+        except Exception:
+            pass  # expression not representable in SymEngine; use SymPy
+    # Substitute a symbolic offset once, then specialize it per offset with
+    # the much cheaper xreplace; Derivative nodes in var become Subs nodes
+    # at var + step exactly as a direct subs() would produce.
+    step = sp.Dummy('step')
+    shifted = expr.subs(var, var + step)
+    return {k: shifted.xreplace({step: k*h}) for k in offsets}
+
+def _reduce_numerator(num, simplify):
+    """Bring a stencil numerator into the form requested by --simplify."""
+    if simplify == 'cancel':
+        return sp.cancel(sp.together(num))
+    if simplify == 'none':
+        return num
+    raise ValueError("Unsupported simplify mode: {}".format(simplify))
+
+def _common_factor(num, h):
+    """Split num into (c * h**k, rest) with the numeric content c and the
+    highest power h**k shared by all terms of its numerator pulled out of
+    rest. The denominator of a rational num is left as it is."""
+    p, q = sp.fraction(num)
+    content, prim = p.as_content_primitive()
+    terms = sp.Add.make_args(prim)
+    k = min(term.as_coeff_exponent(h)[1] for term in terms)
+    if not (k.is_Integer and k > 0):
+        k = 0
+    rest = sp.Add(*(term / h**k for term in terms)) if k else prim
+    return content * h**k, rest / q
+
+def generate_central_diff(expr, var, order=2, shifts=None, simplify='cancel'):
+    """Generate a central finite-difference stencil for derivative wrt var.
+
+    shifts may hold precomputed values from central_shifts() so that the
+    substitutions can be shared between the 2nd- and 4th-order stencils.
+    simplify selects how the result is reduced: 'cancel' puts only the
+    numerator into rational normal form, divides its numeric content and
+    common powers of h into the known 1/(2h) or 1/(12h) factor and keeps
+    that factor separate, 'none' leaves the numerator untouched and
+    'full' runs sp.simplify over the whole stencil. SymEngine shifts are
+    summed in SymEngine, so with 'none' their numerator comes back already
+    distributed.
+    """
     h = sp.symbols('h')
+    if shifts is None:
+        shifts = central_shifts(expr, var, h)
     if order == 2:
-        stencil = (expr.subs(var, var+h) - expr.subs(var, var-h)) / (2*h)
+        weights = {1: 1, -1: -1}
+        factor = sp.Rational(1, 2) * h**-1
         error = 'O(h^2)'
     elif order == 4:
-        stencil = (-expr.subs(var, var+2*h) + 8*expr.subs(var, var+h)
-                   - 8*expr.subs(var, var-h) + expr.subs(var, var-2*h)) / (12*h)
+        weights = {2: -1, 1: 8, -1: -8, -2: 1}
+        factor = sp.Rational(1, 12) * h**-1
         error = 'O(h^4)'
     else:
         raise ValueError("Unsupported stencil order: {}".format(order))
-    return sp.simplify(stencil), error
+    if se is not None and isinstance(shifts[1], se.Basic):
+        # SymEngine shifts: combine natively, then convert the sum back once
+        num = sp.sympify(sum((w * shifts[k] for k, w in weights.items()), se.Integer(0)))
+    else:
+        # Combine without evaluation: a number times a large Add distributes
+        # over every term, so any flattening is left to cancel/simplify below.
+        num = sp.Add(*(shifts[k] if w == 1 else sp.Mul(w, shifts[k], evaluate=False)
+                       for k, w in weights.items()), evaluate=False)
+    if simplify == 'full':
+        return sp.simplify(sp.Mul(num, factor, evaluate=False)), error
+    num = _reduce_numerator(num, simplify)
+    if num.is_zero:
+        return sp.S.Zero, error
+    if simplify == 'cancel':
+        common, num = _common_factor(num, h)
+        factor = common * factor
+    if factor == 1:
+        return num, error
+    stencil = sp.Mul(factor, num, evaluate=False)
+    return stencil, error
+
+def _cache_path(cache_dir, s, **options):
+    """Return the on-disk cache file for expression s rendered with options.
+
+    The key covers the cache format, whether SymEngine is in use and every
+    option that changes the rendered output, so entries written by a
+    different configuration or an older derivation are never reused.
+    """
+    token = repr((_CACHE_FORMAT, se is not None, s, sorted(options.items())))
+    key = hashlib.blake2b(token.encode(), digest_size=16).hexdigest()
+    return pathlib.Path(cache_dir, key + ".pkl")
+
+def expression_rhs(s):
+    """Return the right-hand side of an extracted equation, stripped."""
+    # Clean up the expression string
+    s = s.strip()
+    # If it's an equation (contains =), take the last part (RHS)
+    if '=' in s:
+        s = s.split('=')[-1].strip()
+    return s
+
+def _is_trivial_subexpression(expr):
+    """True for subexpressions not worth naming: monomials such as -r, 2h,
+    dr^2 or 4 h r, built only from numbers, atoms and small integer powers
+    of atoms."""
+    _, rest = expr.as_coeff_Mul()
+    for factor in sp.Mul.make_args(rest):
+        if factor.is_Pow:
+            if not (factor.base.is_Atom and factor.exp.is_Integer and abs(factor.exp) <= 3):
+                return False
+        elif not factor.is_Atom:
+            return False
+    return True
+
+def stencil_latex(stencil, cse=True):
+    """Render stencil as LaTeX, optionally factoring out common subexpressions.
+
+    Returns (definitions, body): definitions is a list of aligned
+    "\\tau_{k} &= ..." lines, empty when cse is off or nothing worth naming
+    is shared, and body is the stencil written in terms of those names.
+    Trivial subexpressions (see _is_trivial_subexpression()) are inlined
+    back rather than named.
+    """
+    if not cse:
+        return [], sp.latex(stencil)
+    repl, reduced = sp.cse(stencil, symbols=sp.numbered_symbols('_cse'))
+    names = sp.numbered_symbols('tau')
+    inline = {}
+    kept = []
+    for sym, sub in repl:
+        sub = sub.xreplace(inline)
+        if _is_trivial_subexpression(sub):
+            inline[sym] = sub
+        else:
+            inline[sym] = next(names)
+            kept.append((inline[sym], sub))
+    if not kept:
+        return [], sp.latex(stencil)
+    defs = [sp.latex(sym) + " &= " + sp.latex(sub) for sym, sub in kept]
+    return defs, sp.latex(reduced[0].xreplace(inline))
+
+def _identifier(name, taken):
+    """Return a valid Python identifier derived from name and not in taken."""
+    ident = re.sub(r"\W", "_", re.sub(r"[{}\\]", "", name)) or "_"
+    if ident[0].isdigit() or keyword.iskeyword(ident):
+        ident = "_" + ident
+    while ident in taken:
+        ident += "_"
+    taken.add(ident)
+    return ident
+
+def _numeric_form(stencil):
+    """Return (expr, inputs) with every input replaced by an identifier symbol.
+
+    Each applied undefined function, e.g. f(h + r, t), becomes a symbol
+    standing for that grid sample, and free symbols such as r_{0} are
+    renamed to valid Python identifiers; inputs maps each new symbol to the
+    expression it stands for. Returns None when the stencil still contains
+    derivatives or Subs nodes, which have no numeric counterpart.
+    """
+    if stencil.atoms(sp.Derivative, sp.Subs):
+        return None
+    applied = stencil.atoms(AppliedUndef)
+    # Only outermost applications are sampled; nested ones are folded in
+    samples = sorted((fn for fn in applied
+                      if not any(g != fn and g.has(fn) for g in applied)),
+                     key=sp.default_sort_key)
+    # Symbols used only inside a sample's arguments are not inputs
+    placeholders = {fn: sp.Dummy() for fn in samples}
+    free = sorted(stencil.xreplace(placeholders).free_symbols - set(placeholders.values()),
+                  key=str)
+
+    # Plain symbols are named first so sample names can never shadow them
+    taken = set()
+    replacements = {sym: sp.Symbol(_identifier(str(sym), taken)) for sym in free}
+    for i, fn in enumerate(samples):
+        replacements[fn] = sp.Symbol(_identifier("{}_{}".format(fn.func.__name__, i), taken))
+    inputs = {new: old for old, new in replacements.items()}
+    return stencil.xreplace(replacements), inputs
+
+def numeric_source(stencil, title, backend='numba'):
+    """Return (source, payload) for a module defining evaluate() for stencil.
+
+    With the 'numba' backend the source holds an @njit-compiled function and
+    payload is None. With 'symengine-llvm' the stencil is compiled by
+    SymEngine's LLVM backend, payload is the pickled callable and the source
+    is a stub that loads it from the .pkl file next to the module. Returns
+    None when the stencil has no numeric form (see _numeric_form()).
+    """
+    form = _numeric_form(stencil)
+    if form is None:
+        return None
+    expr, inputs = form
+    args = sorted(inputs, key=str)
+    arg_list = ", ".join(map(str, args))
+
+    doc = title
+    renamed = ["    {} = {}".format(new, old) for new, old in inputs.items()
+               if str(new) != str(old)]
+    if renamed:
+        doc += "\n\nInputs:\n" + "\n".join(renamed)
+
+    if backend == 'symengine-llvm' and args:
+        compiled = se.Lambdify([se.sympify(a) for a in args], se.sympify(expr),
+                               backend='llvm', cse=True)
+        return _LLVM_STUB_TEMPLATE.format(doc=doc, args=arg_list), pickle.dumps(compiled)
+
+    printer = NumPyPrinter()
+    repl, reduced = sp.cse(expr, symbols=sp.numbered_symbols('_t', exclude=args))
+    body = ["    {} = {}".format(sym, printer.doprint(sub)) for sym, sub in repl]
+    body.append("    return {}".format(printer.doprint(reduced[0])))
+    return _NUMERIC_TEMPLATE.format(doc=doc, args=arg_list, body="\n".join(body)), None
+
+def _process_expr(s, simplify='cancel', emit_numeric=False, cse=True, cache_dir=None,
+                  backend='numba'):
+    """Parse one extracted expression and return its stencil tuples.
+
+    Each tuple is (derivative LaTeX, stencil LaTeX, error, var name, order
+    label, numeric module, CSE definitions) as produced by stencil_latex()
+    and numeric_source(); rendering happens here so that no SymPy objects
+    are sent back to the main process. The numeric module is None unless
+    emit_numeric is set and numeric_source() can handle the stencil. Runs in
+    a worker process when --jobs > 1, so it must stay a module-level
+    function.
+
+    With cache_dir, the rendered tuples are persisted per expression and
+    a warm entry is returned before any parsing; results from expressions
+    that raised a warning are not cached. Cache read and write failures
+    only print a warning and never fail the expression.
+    """
+    s = expression_rhs(s)
+    path = None
+    if cache_dir is not None:
+        path = _cache_path(cache_dir, _normalize_whitespace(s), simplify=simplify,
+                           emit_numeric=emit_numeric, cse=cse, backend=backend)
+        try:
+            return pickle.loads(path.read_bytes())
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            print(f"Warning: Ignoring unreadable cache entry {path}: {e}")
+
+    stencils, complete = _derive_stencils(s, simplify, emit_numeric, cse, backend)
+    if path is not None and complete:
+        # Write then rename so concurrent workers never see a partial file
+        tmp = path.with_suffix(f".{os.getpid()}.tmp")
+        try:
+            tmp.write_bytes(pickle.dumps(stencils))
+            os.replace(tmp, path)
+        except OSError as e:
+            print(f"Warning: Could not write cache entry {path}: {e}")
+            try:
+                tmp.unlink()
+            except OSError:
+                pass
+    return stencils
+
+def _derive_stencils(s, simplify, emit_numeric, cse, backend):
+    """Do the symbolic work for _process_expr(); return (stencils, complete)."""
+    # Define coordinates
+    r, theta, phi, t = sp.symbols('r theta phi t')
+    h = sp.symbols('h')
+    spatial_vars = [r, theta, phi]
+
+    stencils = []
+    complete = True
+    try:
+        sym_expr = parse_latex_cached(s)
+
+        # Check if the expression contains spatial variables
+        free_symbols = sym_expr.free_symbols
+        relevant_vars = [var for var in spatial_vars if var in free_symbols]
+
+        for var in relevant_vars:
+            try:
+                deriv = sp.diff(sym_expr, var)
+                if deriv.is_zero:
+                    continue
+                shifts = central_shifts(sym_expr, var, h)
+                stencil2, err2 = generate_central_diff(sym_expr, var, order=2, shifts=shifts,
+                                                       simplify=simplify)
+                if stencil2.is_zero:
+                    # expr is even about every point in var, so the wider
+                    # stencil vanishes as well
+                    stencil4, err4 = sp.S.Zero, 'O(h^4)'
+                else:
+                    stencil4, err4 = generate_central_diff(sym_expr, var, order=4, shifts=shifts,
+                                                           simplify=simplify)
+                # Render everything here so both stencil orders share one
+                # traversal of the derivative and the parent only writes text
+                deriv_tex, var_name = sp.latex(deriv), str(var)
+                for stencil, err, order in ((stencil2, err2, "2nd order"),
+                                            (stencil4, err4, "4th order")):
+                    numeric = None
+                    if emit_numeric:
+                        numeric = numeric_source(stencil, f"{order} derivative w.r.t. {var_name}",
+                                                 backend=backend)
+                    defs, stencil_tex = stencil_latex(stencil, cse=cse)
+                    stencils.append((deriv_tex, stencil_tex, err, var_name, order,
+                                     numeric, defs))
+            except Exception as e:
+                complete = False
+                print(f"Warning: Could not generate stencil for {var}: {e}")
+
+    except Exception as e:
+        complete = False
+        print(f"Warning: Could not parse expression: {s[:50]}...: {e}")
+    return stencils, complete
+
+def _iter_results(process, expr_strs, jobs):
+    """Yield process(s) for each expression, in order, using jobs workers."""
+    if jobs > 1:
+        with multiprocessing.Pool(jobs) as pool:
+            yield from pool.imap(process, expr_strs, chunksize=4)
+    else:
+        yield from map(process, expr_strs)
+
+def _write_stencil(f, index, entry, stencils_dir=None):
+    """Write one rendered stencil to the main document and, if stencils_dir
+    is given, to its own standalone file numbered by index."""
+    deriv_tex, stencil_tex, err, var_name, order, _, defs = entry
+    if defs:
+        equation = ("\\begin{aligned}\n"
+                    + " \\\\\n".join(defs + [deriv_tex + " &\\approx " + stencil_tex
+                                             + r" \quad (" + err + r")"])
+                    + "\n\\end{aligned}")
+    else:
+        equation = deriv_tex + " \\approx " + stencil_tex + r" \quad (" + err + r")"
+    f.write(f"% {order} derivative w.r.t. {var_name}\n\\[\n{equation}\n\\]\n\n")
+
+    if stencils_dir is None:
+        return
+
+    # Write individual stencil file
+    order_name = order.replace(" ", "_")
+    stencil_filename = os.path.join(stencils_dir, f"stencil_{var_name}_{order_name}_{index:03d}.tex")
+    parts = [
+        _PREAMBLE,
+        f"\\section*{{Finite Difference Stencil: {order} derivative w.r.t. ${var_name}$}}\n\n",
+        f"% Original derivative: {deriv_tex}\n",
+        f"% Variable: {var_name}\n",
+        f"% Order: {order}\n",
+        f"% Error order: {err}\n\n",
+        f"\\[\n{equation}\n\\]\n\n",
+        _POSTAMBLE,
+    ]
+    pathlib.Path(stencil_filename).write_text("".join(parts))
+
+def _write_numeric(index, entry, numeric_dir):
+    """Write the numeric module for one stencil; return False if it has none."""
+    numeric = entry[5]
+    if numeric is None:
+        print(f"Warning: No numeric form for stencil {index:03d} "
+              f"({entry[4]} w.r.t. {entry[3]}); skipping")
+        return False
+    source, payload = numeric
+    module_path = pathlib.Path(numeric_dir, f"stencil_{index:03d}.py")
+    if payload is not None:
+        module_path.with_suffix(".pkl").write_bytes(payload)
+    module_path.write_text(source)
+    return True
 
 def main():
     parser = argparse.ArgumentParser(
@@ -36,94 +487,88 @@ def main():
                         help="Path to final_expressions.tex")
     parser.add_argument('--output', '-o', required=True,
                         help="Path to write discretization.tex")
+    parser.add_argument('--simplify', choices=SIMPLIFY_MODES, default='cancel',
+                        help="How to reduce each stencil: 'none', 'cancel' "
+                             "(rational normal form of the numerator) or "
+                             "'full' (sp.simplify, slowest)")
+    parser.add_argument('--emit-individual', action='store_true',
+                        help="Also write one standalone .tex file per stencil "
+                             "into stencils/")
+    parser.add_argument('--emit-numeric', action='store_true',
+                        help="Also write a Numba-compiled evaluate() module per "
+                             "stencil into stencils_numeric/")
+    parser.add_argument('--backend', choices=NUMERIC_BACKENDS, default='numba',
+                        help="Compiler for --emit-numeric modules: 'numba' (@njit "
+                             "source) or 'symengine-llvm' (pickled SymEngine "
+                             "LLVM callable plus a loader stub)")
+    parser.add_argument('--cse', action=argparse.BooleanOptionalAction, default=True,
+                        help="Factor common subexpressions out of each stencil "
+                             "into aligned tau_k definitions (default: on)")
+    parser.add_argument('--cache-dir', default=None,
+                        help="Directory for a persistent cache of derived stencils, "
+                             "e.g. .stencil_cache/ (default: no disk cache)")
+    parser.add_argument('--jobs', '-j', type=int, default=os.cpu_count() or 1,
+                        help="Number of worker processes (default: all cores; "
+                             "1 runs serially)")
     args = parser.parse_args()
+    if args.backend != 'numba' and not args.emit_numeric:
+        parser.error(f"--backend {args.backend} only applies together with --emit-numeric")
+    if args.backend == 'symengine-llvm' and se is None:
+        parser.error("--backend symengine-llvm requires the symengine package")
 
-    with open(args.input, 'r') as f:
-        tex = f.read()
-
-    expr_strs = extract_expressions(tex)
-
-    # Define coordinates
-    r, theta, phi, t = sp.symbols('r theta phi t')
-    spatial_vars = [r, theta, phi]
-
-    stencils = []
-    for s in expr_strs:
-        try:
-            # Clean up the expression string
-            s = s.strip()
-            # Skip if it's an equation (contains =)
-            if '=' in s:
-                # Try to extract the right-hand side of the equation
-                parts = s.split('=')
-                if len(parts) >= 2:
-                    s = parts[-1].strip()  # Take the last part (RHS)
-                else:
-                    continue
-            
-            sym_expr = parse_latex(s)
-            
-            # Check if the expression contains spatial variables
-            free_symbols = sym_expr.free_symbols
-            relevant_vars = [var for var in spatial_vars if var in free_symbols]
-            
-            if relevant_vars:
-                for var in relevant_vars:
-                    try:
-                        stencil2, err2 = generate_central_diff(sym_expr, var, order=2)
-                        stencil4, err4 = generate_central_diff(sym_expr, var, order=4)
-                        stencils.append((sp.diff(sym_expr, var), stencil2, err2, var, "2nd order"))
-                        stencils.append((sp.diff(sym_expr, var), stencil4, err4, var, "4th order"))
-                    except Exception as e:
-                        print(f"Warning: Could not generate stencil for {var}: {e}")
-                        
-        except Exception as e:
-            print(f"Warning: Could not parse expression: {s[:50]}...: {e}")
-            continue
+    # Deduplicate right-hand sides so repeated expressions are processed once
+    unique = {}
+    key_order = []
+    for body in iter_input_expressions(args.input):
+        s = expression_rhs(body)
+        key = _normalize_whitespace(s)
+        if key not in unique:
+            unique[key] = s
+        key_order.append(key)
 
     # Create stencils directory
     stencils_dir = "stencils"
-    os.makedirs(stencils_dir, exist_ok=True)
+    if args.emit_individual:
+        os.makedirs(stencils_dir, exist_ok=True)
+    if args.cache_dir is not None:
+        os.makedirs(args.cache_dir, exist_ok=True)
+    numeric_dir = "stencils_numeric"
+    if args.emit_numeric:
+        os.makedirs(numeric_dir, exist_ok=True)
+        pathlib.Path(numeric_dir, "__init__.py").touch()
 
-    # Write out LaTeX document
+    # Write out LaTeX document, streaming stencils as workers finish them
+    count = 0
+    numeric_count = 0
     with open(args.output, 'w') as f:
-        f.write(r"\documentclass{article}" + "\n")
-        f.write(r"\usepackage{amsmath}" + "\n")
-        f.write(r"\usepackage[margin=0.5in]{geometry}" + "\n")
-        f.write(r"\begin{document}" + "\n\n")
-        f.write(r"\section*{Finite Difference Stencils}" + "\n\n")
-        
-        for i, (deriv, stencil, err, var, order) in enumerate(stencils):
-            f.write(f"% {order} derivative w.r.t. {var}\n")
-            f.write(r"\[" + "\n")
-            f.write(sp.latex(deriv) + " \\approx " + sp.latex(stencil) +
-                    r" \quad (" + err + r")" + "\n")
-            f.write(r"\]" + "\n\n")
-            
-            # Write individual stencil file
-            var_name = str(var)
-            order_name = order.replace(" ", "_")
-            stencil_filename = os.path.join(stencils_dir, f"stencil_{var_name}_{order_name}_{i+1:03d}.tex")
-            with open(stencil_filename, 'w') as stencil_file:
-                stencil_file.write(r"\documentclass{article}" + "\n")
-                stencil_file.write(r"\usepackage{amsmath}" + "\n")
-                stencil_file.write(r"\usepackage[margin=0.5in]{geometry}" + "\n")
-                stencil_file.write(r"\begin{document}" + "\n\n")
-                stencil_file.write(f"\\section*{{Finite Difference Stencil: {order} derivative w.r.t. ${var_name}$}}\n\n")
-                stencil_file.write(f"% Original derivative: {sp.latex(deriv)}\n")
-                stencil_file.write(f"% Variable: {var_name}\n")
-                stencil_file.write(f"% Order: {order}\n")
-                stencil_file.write(f"% Error order: {err}\n\n")
-                stencil_file.write(r"\[" + "\n")
-                stencil_file.write(sp.latex(deriv) + " \\approx " + sp.latex(stencil) +
-                                 r" \quad (" + err + r")" + "\n")
-                stencil_file.write(r"\]" + "\n\n")
-                stencil_file.write(r"\end{document}" + "\n")
-        
-        f.write(r"\end{document}")
+        f.write(_PREAMBLE + "\\section*{Finite Difference Stencils}\n\n")
+
+        process = functools.partial(_process_expr, simplify=args.simplify,
+                                    emit_numeric=args.emit_numeric, cse=args.cse,
+                                    cache_dir=args.cache_dir, backend=args.backend)
+        results_by_key = {}
+        pos = 0
+        results = _iter_results(process, unique.values(), args.jobs)
+        for key, rendered in zip(unique, results):
+            results_by_key[key] = rendered
+            # Results arrive in first-occurrence order, so every entry up to
+            # the next unseen key can be written now.
+            while pos < len(key_order) and key_order[pos] in results_by_key:
+                for entry in results_by_key[key_order[pos]]:
+                    count += 1
+                    _write_stencil(f, count, entry,
+                                   stencils_dir if args.emit_individual else None)
+                    if args.emit_numeric and _write_numeric(count, entry, numeric_dir):
+                        numeric_count += 1
+                pos += 1
+
+        f.write(_POSTAMBLE)
 
     print(f"Wrote discretization document to {args.output}")
-    print(f"Wrote {len(stencils)} individual stencil files to {stencils_dir}/ directory")
+    if args.emit_individual:
+        print(f"Wrote {count} individual stencil files to {stencils_dir}/ directory")
+    if args.emit_numeric:
+        print(f"Wrote {numeric_count} numeric stencil modules to {numeric_dir}/ directory")
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,143 @@
+import importlib.util
+import pathlib
+
+import pytest
+
+_SCRIPT = pathlib.Path(__file__).resolve().parent.parent / "scripts" / "generate_stencils.py"
+_spec = importlib.util.spec_from_file_location("generate_stencils", _SCRIPT)
+gs = importlib.util.module_from_spec(_spec)
+_spec.loader.exec_module(gs)
+
+
+def test_radial_derivative_input_yields_both_orders():
+    # Derivative nodes must survive the r -> r +- k*h shifts whether or not
+    # SymEngine is installed.
+    entries = gs._process_expr(r"R = r^{2} \frac{\partial}{\partial r} f(r,t)")
+    assert [(e[3], e[4]) for e in entries] == [("r", "2nd order"), ("r", "4th order")]
+
+
+@pytest.mark.parametrize("use_symengine", [True, False])
+def test_radial_derivative_with_and_without_symengine(monkeypatch, use_symengine):
+    if use_symengine and gs.se is None:
+        pytest.skip("symengine not installed")
+    if not use_symengine:
+        monkeypatch.setattr(gs, "se", None)
+    entries = gs._process_expr(r"r \frac{\partial}{\partial r} f(r,t)")
+    assert len(entries) == 2
+
+
+def test_warm_cache_matches_cold_run_without_parsing(tmp_path, monkeypatch):
+    expr = r"r^{2} \sin\theta"
+    cold = gs._process_expr(expr, cache_dir=str(tmp_path))
+    assert cold
+
+    def fail(s):
+        raise AssertionError("warm cache must not parse")
+
+    monkeypatch.setattr(gs, "parse_latex_cached", fail)
+    assert gs._process_expr(expr, cache_dir=str(tmp_path)) == cold
+
+
+def test_unwritable_cache_does_not_fail_the_expression(tmp_path, capsys):
+    missing = tmp_path / "missing"
+    entries = gs._process_expr(r"r^{2} \sin\theta", cache_dir=str(missing))
+    assert entries == gs._process_expr(r"r^{2} \sin\theta")
+    assert "Could not write cache entry" in capsys.readouterr().out
+    assert not missing.exists()
+
+
+def test_cache_key_depends_on_options(tmp_path):
+    base = gs._cache_path(tmp_path, "r", simplify="cancel", cse=True)
+    assert base != gs._cache_path(tmp_path, "r", simplify="full", cse=True)
+    assert base != gs._cache_path(tmp_path, "r", simplify="cancel", cse=False)
+
+
+def test_cancel_divides_h_out_of_polynomial_stencils():
+    # Central differences are exact for quadratics in r, so once the common
+    # h is divided out each stencil must read exactly like the derivative.
+    entries = gs._process_expr(r"r^{2} \sin\theta", cse=False)
+    by_label = {(e[3], e[4]): e for e in entries}
+    for order in ("2nd order", "4th order"):
+        deriv_tex, stencil_tex = by_label[("r", order)][:2]
+        assert stencil_tex == deriv_tex
+
+
+def test_cancel_divides_h_out_of_rational_stencils():
+    # For 1/r the cancelled stencil is a single p/q term; the common h must
+    # still be divided out of p, leaving no h/h that vanishes only in a limit.
+    r, h = gs.sp.symbols("r h")
+    stencils = [gs.generate_central_diff(1 / r, r, order)[0] for order in (2, 4)]
+    assert stencils[0] == -1 / (r**2 - h**2)
+    for stencil in stencils:
+        assert stencil.subs(h, 0) == -1 / r**2
+
+
+def test_whitespace_normalization_keeps_distinct_commands_apart():
+    assert gs._normalize_whitespace(r"\sin x") != gs._normalize_whitespace(r"\sinx")
+    assert gs._normalize_whitespace(" r^{2}\n  \\theta ") == gs._normalize_whitespace(r"r^{2} \theta")
+
+
+def test_numeric_source_uses_valid_identifiers():
+    pytest.importorskip("numpy")
+    r, r0, f0, h = gs.sp.symbols("r r_{0} f_0 h")
+    g = gs.sp.Function("g")
+    stencil = (gs.sp.exp(-r0 * (r + h)) * f0 - g(r - h)) / (2 * h)
+    source, payload = gs.numeric_source(stencil, "test stencil")
+    assert payload is None
+    namespace = {}
+    exec(compile(source, "stencil.py", "exec"), namespace)
+    params = namespace["evaluate"].__code__.co_varnames[:namespace["evaluate"].__code__.co_argcount]
+    assert all(p.isidentifier() for p in params)
+    # the plain symbol f_0 keeps its name; the g sample must not shadow it
+    assert len(set(params)) == len(params) == 5
+
+
+def test_llvm_stub_imports_with_subscripted_symbols(tmp_path):
+    numpy = pytest.importorskip("numpy")
+    if gs.se is None:
+        pytest.skip("symengine not installed")
+    r, r0, h = gs.sp.symbols("r r_{0} h")
+    stencil = (gs.sp.exp(-r0 * (r + h)) - gs.sp.exp(-r0 * (r - h))) / (2 * h)
+    source, payload = gs.numeric_source(stencil, "test stencil", backend="symengine-llvm")
+    module = tmp_path / "stencil_001.py"
+    module.with_suffix(".pkl").write_bytes(payload)
+    module.write_text(source)
+    namespace = {"__file__": str(module)}
+    exec(compile(source, str(module), "exec"), namespace)
+    expected = (numpy.exp(-0.5 * 1.1) - numpy.exp(-0.5 * 0.9)) / 0.2
+    assert numpy.isclose(namespace["evaluate"](0.1, 1.0, 0.5), expected)
+
+
+def test_backend_requires_emit_numeric(tmp_path, monkeypatch, capsys):
+    src = tmp_path / "in.tex"
+    src.write_text(r"\[ r \]")
+    monkeypatch.setattr("sys.argv", ["generate_stencils.py", "-i", str(src),
+                                     "-o", str(tmp_path / "out.tex"),
+                                     "--backend", "symengine-llvm"])
+    with pytest.raises(SystemExit):
+        gs.main()
+    assert "--emit-numeric" in capsys.readouterr().err
+
+
+def test_symengine_and_sympy_shift_paths_agree(monkeypatch):
+    if gs.se is None:
+        pytest.skip("symengine not installed")
+    r, theta, h = gs.sp.symbols("r theta h")
+    expr = r**3 * gs.sp.sin(theta) + gs.sp.Function("g")(r)
+    se_shifts = gs.central_shifts(expr, r, h)
+    assert isinstance(se_shifts[1], gs.se.Basic)
+    with_se = [gs.generate_central_diff(expr, r, order, shifts=se_shifts) for order in (2, 4)]
+    monkeypatch.setattr(gs, "se", None)
+    without_se = [gs.generate_central_diff(expr, r, order) for order in (2, 4)]
+    assert with_se == without_se
+
+
+def test_cse_skips_trivial_subexpressions():
+    r, h, dr = gs.sp.symbols("r h dr")
+    g = gs.sp.Function("g")
+    trivial = (dr**2 * g(r - 2*h) + dr**2 * g(r + 2*h) + 4*h*r) / (12 * h)
+    assert gs.stencil_latex(trivial) == ([], gs.sp.latex(trivial))
+
+    shared = gs.sp.sin(r + g(h)) ** 2 + gs.sp.cos(r + g(h))
+    defs, body = gs.stencil_latex(shared)
+    assert len(defs) == 1 and r"\tau_{0}" in body